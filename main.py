@@ -3,15 +3,22 @@ Connect to the Zoom Contact Center API, download recorded conversations and
 store them locally. Recordings are downloaded within a specified date/time range.
 """
 
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from collections.abc import Iterator
+import json
 import logging
 import os
 from pathlib import Path
+import shutil
 import sys
 
 from dotenv import load_dotenv
 import requests
+from requests.adapters import HTTPAdapter
+import urllib3
+from urllib3.util import Retry
 import timeframes
-from zoom import Client
+from zoom import Client, ZoomAuthError
 
 # Configure logging
 logging.basicConfig(format="%(levelname)s:%(asctime)s %(message)s", datefmt="%d/%m/%Y %H:%M:%S", level=logging.INFO)
@@ -25,6 +32,54 @@ ZOOM_CLIENT_SECRET = str(os.environ.get("ZOOM_CLIENT_SECRET"))
 # Set the path where you would like to store the recordings
 RECORDING_PATH = Path.home() / "Desktop" / "Recordings"
 
+# Set the maximum number of recordings to download concurrently
+MAX_WORKERS = 16
+
+# Set the maximum number of days queried concurrently when listing recordings, kept low to respect Zoom's rate limits
+MAX_LIST_WORKERS = 4
+
+# Size of each chunk read from the network and written to disk while downloading
+CHUNK_SIZE = 128 * 1024
+
+# Size of the buffer used when writing recordings to disk, chunks are collected here so the write() syscalls are batched
+WRITE_BUFFER_SIZE = 1024 * 1024
+
+# File extension used for each channel type, anything not listed here is saved as mp4
+FILE_EXTENSIONS = {"voice": "mp3", "video": "mp4", "chat": "mp4", "sms": "mp4"}
+
+
+def api_get(client: Client, session: requests.Session, url: str, **kwargs) -> requests.Response:
+    """Method to send a GET request to the Zoom API, generating a new bearer token first if the current one has expired.
+    If the API rejects the token with a 401 the token is discarded, along with any cached copy, and the request is
+    retried once with a new token.
+
+    Args:
+        client (zoom.Client): The Zoom client connection object that contains the bearer token and base URL.
+        session (requests.Session): The shared session, carrying the Authorization header and connection pool.
+        url (str): The URL to request.
+        **kwargs: Passed through to requests.Session.get.
+
+    Returns:
+        The requests.Response object.
+    """
+    client.refresh_token()
+    _sync_auth_header(client, session)
+    r = session.get(url, **kwargs)
+    if r.status_code == 401:
+        r.close()
+        client.invalidate_token(r.request.headers["Authorization"].removeprefix("Bearer "))
+        client.refresh_token()
+        _sync_auth_header(client, session)
+        r = session.get(url, **kwargs)
+    return r
+
+
+def _sync_auth_header(client: Client, session: requests.Session) -> None:
+    """Copy the client's current Authorization header to the shared session, if another thread has refreshed the
+    token and not yet updated the session."""
+    if session.headers.get("Authorization") != client.auth_header["Authorization"]:
+        session.headers.update(client.auth_header)
+
 
 class Recording:
     """Object to represent a recorded asset
@@ -41,6 +96,7 @@ class Recording:
         channel_type (str): The channel type, either voice, video, chat or sms.
         recording_id (str): The unique identifier for the recording from the Zoom API.
         download_url (str): The URL provided by the Zoom API that is used to download the recording.
+        base_path (pathlib.Path): The directory where the recording should be stored locally, defaults to RECORDING_PATH.
 
     Attributes:
         start_time (str): The time and date the recording started, in ISO 8601 format.
@@ -49,137 +105,194 @@ class Recording:
         recording_id (str): The unique identifier for the recording from the Zoom API.
         download_url (str): The URL provided by the Zoom API that is used to download the recording.
         filename (str): The filename generated based on start_time, engagement_id, recording_id and channel_type.
+        local_path (pathlib.Path): The full path where the recording will be saved, base_path / filename.
 
     """
 
+    __slots__ = ("start_time", "engagement_id", "channel_type", "recording_id", "download_url", "filename", "local_path")
+
     def __init__(
             self,
             start_time: str,
             engagement_id: str,
             channel_type: str,
             recording_id: str,
-            download_url: str
+            download_url: str,
+            base_path: Path = RECORDING_PATH
     ) -> None:
         self.start_time = start_time
         self.engagement_id = engagement_id
         self.channel_type = channel_type
         self.recording_id = recording_id
         self.download_url = download_url
-        self.filename = f"{start_time}_{self.engagement_id}_{self.recording_id}.{
-            "mp3" if self.channel_type == "voice" else "mp4"}"
+        extension = FILE_EXTENSIONS.get(channel_type, "mp4")
+        self.filename = f"{start_time}_{engagement_id}_{recording_id}.{extension}"
+        self.local_path = base_path / self.filename
 
-    def download(self, client: Client, path: Path) -> bool:
-        """Method to download the recorded asset represented by the object. This method will accept a client connection
-        object containing a valid bearer token for accessing the Zoom API, and a Path object containing the path where
-        the recording should be saved. 
+    def download(self, client: Client, session: requests.Session) -> bool:
+        """Method to download the recorded asset represented by the object to its local_path. This method will accept a
+        client connection object containing a valid bearer token for accessing the Zoom API, and the shared HTTP session
+        used for all requests to the Zoom API.
 
         Args:
             client (zoom.Client): The Zoom client connection object that contains the bearer token and base URL.
-            path (pathlib.Path): A path object, where the recording should be stored locally. 
+            session (requests.Session): The shared session, carrying the Authorization header and connection pool.
 
         Returns:
-            True if successful. Any failed attempt to download will exit with sys.exit(1)
+            True. A failed download is logged as a warning and any partially written file is removed.
         """
-        headers = {
-            "Authorization": f"Bearer {client.token}"
-        }
-        # start_time = datetime.fromisoformat(self.start_time).strftime("%y%d%m_%H%M%S")
+        filename = self.local_path
+        if filename.exists() and filename.stat().st_size > 0:
+            logging.debug("Skipping %s, already downloaded", filename)
+            return True
         try:
-            if not path.exists():
-                path.mkdir(parents=True)
-        except PermissionError as err:
-            logging.info(
-                "%s, please check your RECORDING_PATH and try again", err)
-            exit(1)
-        filename = Path(path, self.filename)
-        with requests.Session() as req:
-            if client.token_has_expired:
-                logging.debug(
-                    "Bearer token has expired, generating a new one...")
-                client.get_token()
-                headers["Authorization"] = f"Bearer {client.token}"
-            try:
-                r = req.get(self.download_url, headers=headers, stream=True)
+            # Read straight from the underlying urllib3 response, closing it afterwards to release the pooled connection
+            with api_get(client, session, self.download_url, stream=True) as r:
                 logging.debug("Downloading %s", self.download_url)
                 r.raise_for_status()
-                with open(filename, mode="wb") as f:
-                    logging.info("Saving as %s", filename)
-                    for chunk in r.iter_content(chunk_size=10 * 1204):
-                        f.write(chunk)
-            except requests.HTTPError as err:
-                logging.warning(err)
+                r.raw.decode_content = True
+                # Write to a temporary file first so an interrupted download never leaves a partial recording behind
+                partial = filename.with_suffix(f"{filename.suffix}.part")
+                try:
+                    with open(partial, mode="wb", buffering=WRITE_BUFFER_SIZE) as f:
+                        logging.info("Saving as %s", filename)
+                        shutil.copyfileobj(r.raw, f, length=CHUNK_SIZE)
+                    os.replace(partial, filename)
+                except BaseException:
+                    partial.unlink(missing_ok=True)
+                    raise
+        # Errors raised while reading r.raw come straight from urllib3, requests does not translate them
+        except (requests.RequestException, urllib3.exceptions.HTTPError) as err:
+            logging.warning("Unable to download %s: %s", self.download_url, err)
         return True
 
     def __repr__(self):
         return f"Recording(start_time={self.start_time!r}, engagement_id={self.engagement_id!r}, recording_id={self.recording_id!r}, channel_type={self.channel_type!r}, download_url={self.download_url!r})"
 
 
-def get_recording_list(client: Client, date_range: callable) -> list[Recording]:
-    """Method to query the Zoom API to obtain a list of recordings based on the start and end date range provided.
+def iter_recordings(client: Client, date_range: dict[str, str], session: requests.Session) -> Iterator[Recording]:
+    """Generator to query the Zoom API for recordings based on the start and end date range provided. Recordings are
+    yielded as each page of results arrives, so downloads can begin before pagination has finished.
 
     Args:
         client (zoom.Client): The Zoom client connection object that contains the bearer token and base URL.
-        start_range (str): The starting date & time in ISO 8601 format, example '2023-09-01T00:00:00'.
-        end_range (str): The ending date & time in ISO 8601 format, example '2023-09-30T23:59:59'.
+        date_range (dict): The "from" and "to" date & time in ISO 8601 format, example '2023-09-01T00:00:00'.
+        session (requests.Session): The shared session, carrying the Authorization header and connection pool.
 
-    Returns:
-        A list of Recording objects. If no recordings are returned by the API then an empty list is returned.
+    Yields:
+        A Recording object for each recording returned by the API.
+
+    Raises:
+        requests.RequestException: If a page of recordings cannot be retrieved.
     """
-    logging.info("Getting list of recordings...")
-    recording_list = []
+    logging.info("Getting list of recordings from %s to %s...", date_range["from"], date_range["to"])
+    count = 0
     endpoint = f"{client.base_url}/contact_center/recordings"
-    headers = {
-        "Authorization": f"Bearer {client.token}",
-    }
     params = {
-        **date_range(),
+        **date_range,
         "channel_type": "voice",
         "next_page_token": ""
     }
 
-    with requests.Session() as req:
-        try:
-            while True:
-                if client.token_has_expired:
-                    logging.debug(
-                        "Bearer token has expired, generating a new one...")
-                    client.get_token()
-                    headers["Authorization"] = f"Bearer {client.token}"
-                r = req.get(endpoint, headers=headers, timeout=3000)
-                r.raise_for_status()
-                response_body = r.json()
-                if response_body["recordings"]:
-                    for recording in response_body["recordings"]:
-                        recording_list.append(
-                            Recording(
-                                recording["recording_start_time"],
-                                recording["engagement_id"],
-                                recording["channel_type"],
-                                recording["recording_id"],
-                                recording["download_url"]
-                            )
-                        )
-                params["next_page_token"] = r.json()["next_page_token"]
-                if not params["next_page_token"]:
-                    break
-        except requests.HTTPError as err:
-            logging.info("Unable to retrieve the list of recordings")
-            logging.debug(err)
-            sys.exit(1)
-    logging.info("Returning %s records", len(recording_list))
-    return recording_list
+    try:
+        while True:
+            r = api_get(client, session, endpoint, params=params, timeout=3000)
+            r.raise_for_status()
+            response_body = json.loads(r.content)
+            for recording in response_body.get("recordings") or ():
+                count += 1
+                yield Recording(
+                    recording["recording_start_time"],
+                    recording["engagement_id"],
+                    recording["channel_type"],
+                    recording["recording_id"],
+                    recording["download_url"]
+                )
+            params["next_page_token"] = response_body.get("next_page_token", "")
+            if not params["next_page_token"]:
+                break
+    except requests.RequestException as err:
+        logging.info("Unable to retrieve the list of recordings")
+        logging.debug(err)
+        raise
+    logging.info("Found %s records from %s to %s", count, date_range["from"], date_range["to"])
+
+
+def queue_downloads(
+        client: Client,
+        date_range: dict[str, str],
+        session: requests.Session,
+        executor: ThreadPoolExecutor
+) -> list[Future]:
+    """Method to submit a download to the executor for each recording found within the date range provided.
+
+    Args:
+        client (zoom.Client): The Zoom client connection object that contains the bearer token and base URL.
+        date_range (dict): The "from" and "to" date & time in ISO 8601 format, example '2023-09-01T00:00:00'.
+        session (requests.Session): The shared session, carrying the Authorization header and connection pool.
+        executor (concurrent.futures.ThreadPoolExecutor): The executor that runs the downloads.
+
+    Returns:
+        A list of Future objects, one for each download submitted.
+    """
+    return [executor.submit(recording.download, client, session)
+            for recording in iter_recordings(client, date_range, session)]
 
 
 def main() -> None:
     """Main loop."""
     client = Client(ZOOM_CLIENT_ID, ZOOM_CLIENT_SECRET, ZOOM_ACCOUNT_ID)
-    client.get_token()
+    try:
+        # Only contacts the OAuth endpoint if there is no valid cached token from a previous run
+        client.refresh_token()
+    except ZoomAuthError:
+        sys.exit(1)
     logging.info("Recording path is %s", RECORDING_PATH)
-    recording_list = get_recording_list(client, timeframes.last_week)
-    if recording_list:
-        for recording in recording_list:
-            recording.download(client, RECORDING_PATH)
-        logging.info("Finished!")
+    try:
+        RECORDING_PATH.mkdir(parents=True, exist_ok=True)
+    except PermissionError as err:
+        logging.info(
+            "%s, please check your RECORDING_PATH and try again", err)
+        sys.exit(1)
+    with requests.Session() as session:
+        # Allow one connection per download and list worker, so connections are always returned to the pool and
+        # reused rather than discarded and re-established with a new TLS handshake
+        adapter = HTTPAdapter(
+            pool_connections=MAX_WORKERS,
+            pool_maxsize=MAX_WORKERS + MAX_LIST_WORKERS,
+            # Return the last response once retries run out, so raise_for_status() still reports it as an HTTPError
+            max_retries=Retry(
+                total=3,
+                backoff_factor=0.3,
+                status_forcelist=[429, 500, 502, 503, 504],
+                raise_on_status=False
+            )
+        )
+        session.mount("https://", adapter)
+        session.headers.update(client.auth_header)
+        # Each day of the date range is paginated separately, so several days can be listed at the same time
+        date_ranges = timeframes.split_range(timeframes.last_week())
+        with (
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor,
+            ThreadPoolExecutor(max_workers=MAX_LIST_WORKERS) as list_executor
+        ):
+            try:
+                list_futures = [list_executor.submit(queue_downloads, client, date_range, session, executor)
+                                for date_range in date_ranges]
+                futures = [future for list_future in as_completed(list_futures) for future in list_future.result()]
+                for future in as_completed(futures):
+                    future.result()
+            except (ZoomAuthError, requests.RequestException) as err:
+                # Drop everything still queued rather than letting each queued download fail in turn
+                list_executor.shutdown(wait=False, cancel_futures=True)
+                executor.shutdown(wait=False, cancel_futures=True)
+                if isinstance(err, ZoomAuthError):
+                    logging.info("Unable to renew the bearer token, stopping")
+                else:
+                    logging.info("Unable to list every recording in the date range, stopping")
+                sys.exit(1)
+        if futures:
+            logging.info("Finished!")
 
 
 if __name__ == "__main__":
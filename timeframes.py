@@ -1,53 +1,90 @@
-"""Functions to return various timeframes"""
+"""Functions to return various timeframes. Dates are calculated in UTC, matching the times used by the Zoom API"""
 
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache, wraps
 import calendar
+import time
 
+_ONE_SECOND = timedelta(seconds=1)
+_ONE_DAY = timedelta(days=1)
+_SIX_DAYS = timedelta(days=6)
+_ONE_WEEK = timedelta(weeks=1)
 
+
+def _cache_per_minute(func):
+    """Cache the result of a timeframe function for the rest of the current minute, returning a copy each time so
+    callers cannot modify the cached dict"""
+
+    @lru_cache(maxsize=1)
+    def cached(minute: int) -> dict[str, str]:
+        return func()
+
+    @wraps(func)
+    def wrapper() -> dict[str, str]:
+        return dict(cached(int(time.time()) // 60))
+
+    return wrapper
+
+
+def _utc_today() -> date:
+    """Return the current date in UTC"""
+    return datetime.now(timezone.utc).date()
+
+
+def _range(start_date: date, end_date: date) -> dict[str, str]:
+    """Return the start of start_date and the end of end_date in iso format"""
+    return {
+        "from": f"{start_date.year:04d}-{start_date.month:02d}-{start_date.day:02d}T00:00:00",
+        "to": f"{end_date.year:04d}-{end_date.month:02d}-{end_date.day:02d}T23:59:59"
+    }
+
+
+@_cache_per_minute
 def last_month() -> dict[str, str]:
     """Return a tuple containing the start and end times of the previous month in iso format"""
-    one_month_ago = datetime.now() - timedelta(weeks=4)
-    days_in_month = calendar.monthrange(one_month_ago.year, one_month_ago.month)[-1]
-    start_date = datetime(one_month_ago.year, one_month_ago.month, 1).isoformat(timespec="seconds")
-    end_date = datetime(one_month_ago.year, one_month_ago.month, days_in_month, 23, 59, 59).isoformat(timespec="seconds")
-    return {"from": start_date, "to": end_date}
+    date_today = _utc_today()
+    year, month = (date_today.year - 1, 12) if date_today.month == 1 else (date_today.year, date_today.month - 1)
+    return _range(date(year, month, 1), date(year, month, calendar.monthrange(year, month)[-1]))
 
 
-def last_week():
-    """Return a tuple containing the start and end times of the previous week in iso format"""
-    date_today = datetime.now()
-    beginning_last_week = date_today - timedelta(days=6 + date_today.day)
-    end_last_week = date_today - timedelta(days=date_today.day)
-    start_date_components = [int(x) for x in str(beginning_last_week.date()).split("-")]
-    end_date_components = [int(x) for x in str(end_last_week.date()).split("-")]
-    start_date = datetime(*start_date_components, 0, 0, 0).isoformat(timespec="seconds")
-    end_date = datetime(*end_date_components, 23, 59, 59).isoformat(timespec="seconds")
-    return {"from": start_date, "to": end_date}
+@_cache_per_minute
+def last_week() -> dict[str, str]:
+    """Return a tuple containing the start and end times of the previous week (Monday to Sunday) in iso format"""
+    date_today = _utc_today()
+    end_last_week = date_today - timedelta(days=date_today.isoweekday())
+    return _range(end_last_week - _SIX_DAYS, end_last_week)
 
 
+@_cache_per_minute
 def last_seven_days() -> dict[str, str]:
     """Return a tuple containing the start and end times of the previous month in iso format"""
-    date_today = datetime.now()
-    one_week_ago = date_today - timedelta(weeks=1)
-    start_date_components = [int(x) for x in str(one_week_ago.date()).split("-")]
-    end_date_components = [int(x) for x in str(date_today.date()).split("-")]
-    start_date = datetime(*start_date_components, 0, 0, 0).isoformat(timespec="seconds")
-    end_date = datetime(*end_date_components, 23, 59, 59).isoformat(timespec="seconds")
-    return {"from": start_date, "to": end_date}
+    date_today = _utc_today()
+    return _range(date_today - _ONE_WEEK, date_today)
 
 
+@_cache_per_minute
 def today() -> dict[str, str]:
     """Return a tuple containing the start and end times of the current day in iso format"""
-    date_components = [int(x) for x in str(datetime.now().date()).split("-")]
-    start_date = datetime(*date_components, 0, 0, 0).isoformat(timespec="seconds")
-    end_date = datetime(*date_components, 23, 59, 59).isoformat(timespec="seconds")
-    return {"from": start_date, "to": end_date}
+    date_today = _utc_today()
+    return _range(date_today, date_today)
 
 
+@_cache_per_minute
 def yesterday() -> dict[str, str]:
     """Return a tuple containing the start and end times of yesterday in iso format"""
-    date_yesterday = datetime.now() - timedelta(days=1)
-    date_components = [int(x) for x in str(date_yesterday.date()).split("-")]
-    start_date = datetime(*date_components, 0, 0, 0).isoformat(timespec="seconds")
-    end_date = datetime(*date_components, 23, 59, 59).isoformat(timespec="seconds")
-    return {"from": start_date, "to": end_date}
+    date_yesterday = _utc_today() - _ONE_DAY
+    return _range(date_yesterday, date_yesterday)
+
+
+def split_range(date_range: dict[str, str], days: int = 1) -> list[dict[str, str]]:
+    """Split a timeframe into consecutive timeframes of at most the given number of days, which together cover the
+    same period"""
+    start = datetime.fromisoformat(date_range["from"])
+    end = datetime.fromisoformat(date_range["to"])
+    step = timedelta(days=days)
+    date_ranges = []
+    while start <= end:
+        window_end = min(start + step - _ONE_SECOND, end)
+        date_ranges.append({"from": start.isoformat(timespec="seconds"), "to": window_end.isoformat(timespec="seconds")})
+        start = window_end + _ONE_SECOND
+    return date_ranges
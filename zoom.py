@@ -5,13 +5,38 @@ bearer token used for authenticating with the Zoom API.
 """
 
 from datetime import datetime
+from pathlib import Path
 import base64
+import json
 import logging
-import sys
+import os
+import tempfile
+import threading
+import time
 
 import requests
 
-logging.basicConfig(format="%(levelname)s:%(asctime)s %(message)s", datefmt="%d/%m/%Y %H:%M:%S", level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Treat the bearer token as expired this many seconds early, so it never lapses during an in-flight request
+EXPIRY_MARGIN = 60
+
+# Bearer tokens are saved here so later runs can reuse them until they expire
+TOKEN_CACHE = Path.home() / ".cache" / "zcc" / "token.json"
+
+
+class ZoomAuthError(RuntimeError):
+    """Raised when a bearer token cannot be generated from the Zoom OAuth endpoint."""
+
+
+def _jwt_expiry(token: str) -> float | None:
+    """Return the exp claim of a JWT bearer token as a POSIX timestamp, or None if the token cannot be decoded."""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, ValueError, KeyError, TypeError):
+        return None
 
 
 class Client:
@@ -22,59 +47,200 @@ class Client:
         client_id (str): The Marketplace app Client ID
         client_secret (str): The Marketplace app Client Secret
         account_id (str): The Marketplace app Account ID
+        token_cache (pathlib.Path): File used to share the bearer token between runs, or None to disable caching
 
     Attributes:
         client_id (str): The Marketplace app Client ID
         account_id (str): The Marketplace app Account ID
         token (str): The bearer token used to authenticate API calls
+        auth_header (dict): The Authorization header for API calls, rebuilt whenever a new token is generated
         expiry_time (float): The expiry time of the bearer token in POSIX timestamp
-        b64 (str): Basic token used for authenticating a bearer token request
+        expiry_monotonic (float): The time.monotonic() value after which the token is treated as expired
     """
 
     base_url = "https://api.zoom.us/v2"
+    oauth_url = "https://zoom.us/oauth/token"
+
+    __slots__ = (
+        "account_id",
+        "client_id",
+        "token",
+        "auth_header",
+        "expiry_time",
+        "expiry_monotonic",
+        "_headers",
+        "_params",
+        "_session",
+        "_lock",
+        "_token_cache",
+        "_auth_error"
+    )
 
-    def __init__(self, client_id: str, client_secret: str, account_id: str) -> None:
+    def __init__(
+            self,
+            client_id: str,
+            client_secret: str,
+            account_id: str,
+            token_cache: Path | None = TOKEN_CACHE
+    ) -> None:
         self.account_id = account_id
         self.client_id = client_id
         self.token = None
+        self.auth_header = None
         self.expiry_time = None
-        self.b64 = base64.b64encode(
-            f"{self.client_id}:{client_secret}".encode()).decode()
+        self.expiry_monotonic = None
+        self._headers = {
+            "Authorization": "Basic " + base64.b64encode(f"{client_id}:{client_secret}".encode()).decode(),
+        }
+        self._params = {
+            "account_id": self.account_id,
+            "grant_type": "account_credentials"
+        }
+        self._session = requests.Session()
+        self._session.headers.update(self._headers)
+        self._lock = threading.RLock()
+        self._token_cache = token_cache
+        self._auth_error = None
+        self._load_cached_token()
 
     def get_token(self) -> str:
         """Contact the Zoom OAuth endpoint to generate a new token.
 
         Returns:
             The new bearer token as a string.
+
+        Raises:
+            ZoomAuthError: If the OAuth endpoint cannot be reached, returns an error, or returns an unexpected response.
         """
 
-        url = "https://zoom.us/oauth/token"
-        headers = {
-            "Authorization": f"Basic {self.b64}",
-        }
-        params = {
+        with self._lock:
+            try:
+                logger.debug("Generating a new bearer token...")
+                r = self._session.post(self.oauth_url, params=self._params, timeout=(3, 10))
+                r.raise_for_status()
+                response_body = r.json()
+                self.token = response_body["access_token"]
+                self.auth_header = {"Authorization": f"Bearer {self.token}"}
+                # Prefer the token's own exp claim when it is shorter than expires_in, but only when it is plausible
+                # against the local clock, a host clock that runs ahead of Zoom's would otherwise expire it instantly
+                expires_in = response_body["expires_in"]
+                jwt_expiry = _jwt_expiry(self.token)
+                now = datetime.now().timestamp()
+                if jwt_expiry is not None and 0 < jwt_expiry - now <= expires_in:
+                    expires_in = jwt_expiry - now
+                self.expiry_time = now + expires_in
+                # Refresh EXPIRY_MARGIN seconds early, but never more often than once per EXPIRY_MARGIN / 2 seconds,
+                # however short the lifetime reported
+                self.expiry_monotonic = time.monotonic() + max(expires_in - EXPIRY_MARGIN, EXPIRY_MARGIN / 2)
+                logger.debug("New token generated, expires at %s", self.expiry_time)
+                self._auth_error = None
+                self._save_cached_token()
+            except requests.HTTPError as err:
+                logger.error("Unable to generate a bearer token: %s", err)
+                raise ZoomAuthError(str(err)) from err
+            except requests.Timeout as err:
+                logger.error("Timed out waiting for a bearer token: %s", err)
+                raise ZoomAuthError(str(err)) from err
+            except requests.RequestException as err:
+                logger.error("Unable to reach the OAuth endpoint: %s", err)
+                raise ZoomAuthError(str(err)) from err
+            except (KeyError, ValueError) as err:
+                logger.error("Unexpected response from the OAuth endpoint: %r", err)
+                raise ZoomAuthError(f"Unexpected response from the OAuth endpoint: {err!r}") from err
+        return self.token
+
+    def _load_cached_token(self) -> None:
+        """Reuse the bearer token saved by a previous run, if it belongs to the same app and has not expired."""
+        if self._token_cache is None:
+            return
+        try:
+            cached = json.loads(self._token_cache.read_text())
+            if cached["account_id"] != self.account_id or cached["client_id"] != self.client_id:
+                return
+            remaining = cached["expiry_time"] - datetime.now().timestamp()
+            if remaining <= EXPIRY_MARGIN:
+                return
+            self.token = cached["access_token"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        self.auth_header = {"Authorization": f"Bearer {self.token}"}
+        self.expiry_time = cached["expiry_time"]
+        self.expiry_monotonic = time.monotonic() + remaining - EXPIRY_MARGIN
+        logger.debug("Using cached token, expires at %s", self.expiry_time)
+
+    def _save_cached_token(self) -> None:
+        """Atomically write the current bearer token to the token cache, readable only by the current user."""
+        if self._token_cache is None:
+            return
+        cached = {
             "account_id": self.account_id,
-            "grant_type": "account_credentials"
+            "client_id": self.client_id,
+            "access_token": self.token,
+            "expiry_time": self.expiry_time
         }
         try:
-            logging.debug("Generating a new bearer token...")
-            r = requests.post(url, headers=headers, params=params, timeout=3000)
-            r.raise_for_status()
-            response_body = r.json()
-            self.token = response_body["access_token"]
-            self.expiry_time = datetime.now().timestamp() + response_body["expires_in"]
-            logging.debug("New token generated, expires at %s", self.expiry_time)
-        except requests.HTTPError as err:
-            print(err)
-            sys.exit(1)
-        return r.json()["access_token"]
+            self._token_cache.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self._token_cache.parent, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(cached, f)
+                os.replace(tmp, self._token_cache)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except OSError as err:
+            logger.debug("Unable to save the token cache: %s", err)
+
+    def invalidate_token(self, token: str) -> None:
+        """Discard a bearer token that the API has rejected, along with the cached copy, so the next call to
+        refresh_token generates a new one. Nothing is discarded if the token has already been replaced.
+
+        Args:
+            token (str): The bearer token that was rejected.
+        """
+        with self._lock:
+            if token != self.token:
+                return
+            logger.debug("Bearer token was rejected, discarding it...")
+            self.expiry_monotonic = None
+            if self._token_cache is not None:
+                try:
+                    self._token_cache.unlink(missing_ok=True)
+                except OSError as err:
+                    logger.debug("Unable to remove the token cache: %s", err)
+
+    def refresh_token(self) -> bool:
+        """Generate a new bearer token if the current one has expired. This is safe to call from several threads at
+        once, only the first thread to find the token expired contacts the OAuth endpoint. If that attempt fails, the
+        error is remembered and raised again for every later call, until get_token is called directly and succeeds.
+
+        Returns:
+            bool: True if a new token was generated, otherwise False.
+
+        Raises:
+            ZoomAuthError: If a new token is needed and cannot be generated.
+        """
+        if not self.token_has_expired:
+            return False
+        with self._lock:
+            if not self.token_has_expired:
+                return False
+            if self._auth_error is not None:
+                raise ZoomAuthError(str(self._auth_error)) from self._auth_error
+            logger.debug("Bearer token has expired, generating a new one...")
+            try:
+                self.get_token()
+            except ZoomAuthError as err:
+                self._auth_error = err
+                raise
+        return True
 
     @property
     def token_has_expired(self) -> bool:
-        """Check if the current bearer token is still valid.
+        """Check if the current bearer token is still valid. A monotonic clock is used so that changes to the system
+        clock cannot affect the result, and the token is treated as expired EXPIRY_MARGIN seconds early.
 
         Returns:
-            bool: True if the token has expired, otherwise False.
+            bool: True if the token has expired or no token has been generated yet, otherwise False.
         """
-        now = datetime.now().timestamp()
-        return now > self.expiry_time
+        return self.expiry_monotonic is None or time.monotonic() >= self.expiry_monotonic